@@ -49,11 +49,15 @@ def get_video_duration(video_path: Path) -> float:
 
 def add_background_music(
     input_video_path: Path, 
-    final_output_path: Path # This is the target file in /output
+    final_output_path: Path, # This is the target file in /output
+    subtitle_path: Path = None
 ):
     """
     Adds background music to a video file, using a temporary file for mixing
     to avoid FFmpeg's 'same as input' error.
+
+    If `subtitle_path` is given, the subtitles are burned in within the same ffmpeg
+    pass, so the video is only re-encoded once.
     """
     setup_directories() 
     
@@ -106,11 +110,17 @@ def add_background_music(
         
         print(f"Mixing audio (BGM reduced by {MUSIC_VOLUME_REDUCTION_DB:.1f}dB) and original video audio...")
 
-        # 6. Output video - WRITE TO TEMPORARY FILE
+        # 6. Burn in subtitles (optional) as part of the same filter graph
+        output_video = input_video.video
+        if subtitle_path:
+            output_video = output_video.filter('subtitles', Path(subtitle_path).as_posix())
+            print(f"Burning in subtitles from: {Path(subtitle_path).name}")
+
+        # 7. Output video - WRITE TO TEMPORARY FILE
         (
             ffmpeg
             .output(
-                input_video.video,
+                output_video,
                 mixed_audio,
                 str(temp_output_path), # <--- WRITE TO TEMP FILE
                 vcodec='libx264',
@@ -123,7 +133,7 @@ def add_background_music(
             .run(quiet=True)
         )
         
-        # 7. FINAL STEP: Move the temp file to the final destination, replacing the old file
+        # 8. FINAL STEP: Move the temp file to the final destination, replacing the old file
         shutil.move(str(temp_output_path), str(final_output_path))
         
         print(f"✅ Audio mix complete. Output written to: '{final_output_path.name}'")
@@ -0,0 +1,42 @@
+import os
+import shutil
+
+# Helpers for the on-disk caches of generated media (illustrations, TTS audio). An entry
+# is trusted as soon as its file exists, so writes must never leave a partial file behind.
+
+
+def store_in_cache(src_path, cache_path):
+    """Copy `src_path` to `cache_path` via a temporary file renamed into place when complete.
+
+    The temporary name includes the source file, so two jobs caching identical content at
+    the same time don't write to the same file.
+    """
+    tmp_path = f"{cache_path}.{os.path.basename(src_path)}.tmp"
+    try:
+        shutil.copyfile(src_path, tmp_path)
+        os.replace(tmp_path, cache_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def copy_from_cache(cache_path, dest_path):
+    """Copy a cache entry to `dest_path` and mark it as recently used for prune_cache."""
+    shutil.copyfile(cache_path, dest_path)
+    os.utime(cache_path)
+
+
+def prune_cache(cache_dir, max_bytes):
+    """Delete the least recently used entries in `cache_dir` until it fits in `max_bytes`."""
+    try:
+        with os.scandir(cache_dir) as it:
+            entries = [(e.stat().st_mtime, e.stat().st_size, e.path) for e in it if e.is_file()]
+    except FileNotFoundError:
+        return
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        os.remove(path)
+        total -= size
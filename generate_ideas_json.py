@@ -1,26 +1,37 @@
+import asyncio
+import functools
 import os
-import json
 import random
 import sys
 from google import genai
 from google.genai import types
 from dotenv import load_dotenv
 
+import json_utils
+
 # Load environment variables
 load_dotenv()
 
-# Initialize the Gemini client (uses GEMINI_API_KEY from .env)
-try:
-    client = genai.Client()
-except Exception as e:
-    print(f"❌ Error initializing Gemini Client: {e}")
-    client = None
+# Initialize the Gemini client (uses GEMINI_API_KEY from .env) on first use. The cached
+# instance is reused afterwards, so repeated calls from a long-running process share
+# one connection pool instead of re-handshaking.
+@functools.lru_cache(maxsize=1)
+def get_genai_client():
+    try:
+        return genai.Client()
+    except Exception as e:
+        print(f"❌ Error initializing Gemini Client: {e}")
+        return None
 
 # ---- SHARED CONFIGURATION ----
 MODEL_NAME_CONVERSATION = "gemini-2.5-pro"  # Robust for strict, complex output
 MODEL_NAME_PODCAST = "gemini-2.5-pro"      # Good for instructional, fast output
 NUM_CONVERSATION_IDEAS = 10
 NUM_PODCAST_IDEAS = 3
+# Larger runs are split into requests of at most this many ideas, sent in parallel
+IDEAS_PER_REQUEST = 10
+# Dedicated RNG for voice assignment; set VOICE_SEED for reproducible picks
+_RNG = random.Random(os.getenv("VOICE_SEED"))
 
 # Consolidated Voice Pool (Used for CONVERSATIONS only)
 VOICES = [
@@ -111,25 +122,63 @@ ALLOWED_PODCAST_CHARACTERS = [
     },
 ]
 
+# Name -> voice_id lookup for podcast characters, built once at import
+_PODCAST_VOICE_MAP = {v["name"].lower(): v["voice_id"] for v in ALLOWED_PODCAST_CHARACTERS}
+
 # --- VOICE ASSIGNMENT HELPERS ---
 
+# Index the voice pool once at import so each character is a dict lookup instead of
+# several linear scans over VOICES. Keys are lowercased to match the lookups below.
+def _index_voices(voices):
+    by_gender_age, by_gender = {}, {}
+    for voice in voices:
+        gender = voice.get("gender", "").lower()
+        age = voice.get("age", "").lower()
+        by_gender.setdefault(gender, []).append(voice)
+        if age:
+            by_gender_age.setdefault((gender, age), []).append(voice)
+    return by_gender_age, by_gender
+
+VOICES_BY_GENDER_AGE, VOICES_BY_GENDER = _index_voices(VOICES)
+
+def _voice_pool(char):
+    gender = char.get("gender", "unknown").lower()
+    age = char.get("age", "").lower()
+    # Prefer voices that match both gender and age, then gender only, then any voice
+    return (age and VOICES_BY_GENDER_AGE.get((gender, age))) or VOICES_BY_GENDER.get(gender) or VOICES
+
 def assign_voice_ids(ideas_list, key="characters"):
     """
     Assigns a voice_id from the *full* VOICES pool based on gender.
     Used for Conversation Ideas.
     """
     for idea in ideas_list:
+        # Group the idea's characters by candidate pool (pools are shared lists, so
+        # identity is the key) and draw each group's voices in a single call
+        groups = {}
         for char in idea.get(key, []):
+            pool = _voice_pool(char)
             gender = char.get("gender", "unknown").lower()
-            age = char.get("age", "").lower()
-            # Prefer voices that match both gender and age, then gender only, then any voice
-            matching = []
-            if age:
-                matching = [v for v in VOICES if v.get("gender", "").lower() == gender and v.get("age", "").lower() == age]
-            if not matching:
-                matching = [v for v in VOICES if v.get("gender", "").lower() == gender]
-            voice = random.choice(matching) if matching else random.choice(VOICES)
-            char["voice_id"] = voice["voice_id"]
+            groups.setdefault(id(pool), (pool, gender, []))[2].append(char)
+
+        # Narrowest pools pick first so their few matching voices aren't taken by a
+        # broader group; every character in an idea gets a distinct voice where possible
+        used = set()
+        for pool, gender, chars in sorted(groups.values(), key=lambda g: len(g[0])):
+            # Widen to the gender pool, then to all voices, when too few are left. Keyed by
+            # voice_id because a few VOICES entries share one.
+            for candidates in (pool, VOICES_BY_GENDER.get(gender), VOICES):
+                available = list({v["voice_id"]: v for v in candidates or () if v["voice_id"] not in used}.values())
+                if len(available) >= len(chars):
+                    voices = _RNG.sample(available, len(chars))
+                    break
+            else:
+                # More characters than voices: use every remaining voice once, then repeat
+                voices = _RNG.sample(available, len(available))
+                voices += _RNG.choices(VOICES, k=len(chars) - len(available))
+            for char, voice in zip(chars, voices):
+                char["voice_id"] = voice["voice_id"]
+                used.add(voice["voice_id"])
     return ideas_list
 
 # **NEW FUNCTION FOR PODCAST VOICES**
@@ -138,15 +187,12 @@ def assign_podcast_voice_ids(ideas_list, key="characters"):
     Assigns voice_id ONLY from the ALLOWED_PODCAST_CHARACTERS list.
     It matches the character's *name* generated by the LLM to the voice_id.
     """
-    # Create a mapping for quick lookup: Name -> voice_id
-    voice_map = {v["name"].lower(): v["voice_id"] for v in ALLOWED_PODCAST_CHARACTERS}
-    
     for idea in ideas_list:
         for char in idea.get(key, []):
             char_name = char.get("name", "").lower()
             
             # Find the voice ID based on the character's name generated by the model
-            voice_id = voice_map.get(char_name)
+            voice_id = _PODCAST_VOICE_MAP.get(char_name)
             
             # Assign the voice_id if a match is found
             if voice_id:
@@ -156,10 +202,102 @@ def assign_podcast_voice_ids(ideas_list, key="characters"):
                 # assign a random voice from the *allowed* list to ensure a voice_id is present.
                 # This helps prevent runtime errors, but the prompt should ideally prevent this.
                 print(f"⚠️ Warning: Character name '{char_name}' not found in allowed podcast voices. Assigning random allowed voice.")
-                char["voice_id"] = random.choice(ALLOWED_PODCAST_CHARACTERS)["voice_id"]
+                char["voice_id"] = _RNG.choice(ALLOWED_PODCAST_CHARACTERS)["voice_id"]
                 
     return ideas_list
 
+def log_cache_usage(response):
+    """Print how many prompt tokens Gemini served from its implicit prefix cache."""
+    usage = response.usage_metadata
+    if usage and usage.cached_content_token_count:
+        print(f"⚡ {usage.cached_content_token_count}/{usage.prompt_token_count} prompt tokens served from cache")
+
+# Batch API jobs are polled with exponential backoff between these bounds (seconds)
+BATCH_POLL_MIN_SECONDS = 10
+BATCH_POLL_MAX_SECONDS = 300
+BATCH_FINAL_STATES = {"JOB_STATE_SUCCEEDED", "JOB_STATE_FAILED", "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED"}
+
+async def run_batch_job(model, config, prompts):
+    """Submit `prompts` as one Gemini Batch API job and return the parsed responses.
+
+    Batch jobs are billed at a discount and draw on a separate rate-limit pool, at the
+    cost of latency (minutes to hours), so this suits scheduled bulk runs.
+    """
+    job = await get_genai_client().aio.batches.create(
+        model=model,
+        src=[types.InlinedRequest(contents=prompt, config=config) for prompt in prompts],
+    )
+    print(f"📦 Submitted batch job {job.name} with {len(prompts)} request(s)")
+
+    delay = BATCH_POLL_MIN_SECONDS
+    while job.state.name not in BATCH_FINAL_STATES:
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, BATCH_POLL_MAX_SECONDS)
+        job = await get_genai_client().aio.batches.get(name=job.name)
+        print(f"⏳ Batch job {job.name}: {job.state.name}")
+
+    if job.state.name != "JOB_STATE_SUCCEEDED":
+        raise RuntimeError(f"Batch job {job.name} ended in state {job.state.name}: {job.error}")
+
+    # A batch can take hours, so one bad response is skipped and logged rather than
+    # discarding every other result with it
+    results = []
+    for i, item in enumerate(job.dest.inlined_responses, 1):
+        if item.error:
+            print(f"⚠️ Batch request {i} failed: {item.error}")
+            continue
+        text = item.response.text if item.response else None
+        if not text:
+            print(f"⚠️ Batch request {i} returned no text (possibly blocked); skipping it")
+            continue
+        try:
+            result = json_utils.loads(text)
+        except json_utils.JSONDecodeError as e:
+            print(f"⚠️ Batch request {i} returned invalid JSON ({e}); skipping it")
+            continue
+        if not isinstance(result, dict):
+            print(f"⚠️ Batch request {i} returned {type(result).__name__} instead of an object; skipping it")
+            continue
+        results.append(result)
+    return results
+
+async def generate_idea_batches(model, config, idea_key, total, build_prompt, use_batch_api=False):
+    """Request `total` ideas as ceil(total / IDEAS_PER_REQUEST) parallel calls and merge them.
+
+    `build_prompt(n)` returns the user prompt asking for `n` ideas. With `use_batch_api`
+    the requests go through a single Batch API job instead of live calls. The metadata
+    of the first batch is kept, and ideas whose title repeats an earlier one are dropped.
+    """
+    async def one_batch(n):
+        response = await get_genai_client().aio.models.generate_content(
+            model=model,
+            contents=[build_prompt(n)],
+            config=config,
+        )
+        log_cache_usage(response)
+        return json_utils.loads(response.text)
+
+    sizes = [min(IDEAS_PER_REQUEST, total - start) for start in range(0, total, IDEAS_PER_REQUEST)]
+    if use_batch_api:
+        batches = await run_batch_job(model, config, [build_prompt(n) for n in sizes])
+        if not batches:
+            raise RuntimeError("Batch job returned no usable responses")
+    else:
+        batches = await asyncio.gather(*(one_batch(n) for n in sizes))
+
+    data = batches[0]
+    seen_titles = set()
+    ideas = []
+    for batch in batches:
+        for idea in batch.get(idea_key, []):
+            title = idea.get("title", "").strip().lower()
+            if title in seen_titles:
+                continue
+            seen_titles.add(title)
+            ideas.append(idea)
+    data[idea_key] = ideas
+    return data
+
 # --- 1. CONVERSATION IDEAS LOGIC (No Change) ---
 
 # Schema for Conversations (2 characters strictly)
@@ -218,27 +356,26 @@ Rules:
 - Only fill in the string values.
 """
 
-def generate_conversation_ideas():
+# Built once at import and reused for every request
+CONVERSATION_CONFIG = types.GenerateContentConfig(
+    system_instruction=CONVERSATION_SYSTEM_PROMPT,
+    response_mime_type="application/json",
+    response_schema=CONVERSATION_SCHEMA
+)
+
+async def generate_conversation_ideas(use_batch_api=False):
     print(f"🪄 Generating {NUM_CONVERSATION_IDEAS} general conversation ideas...")
-    if not client: return None
+    if not get_genai_client(): return None
 
-    config = types.GenerateContentConfig(
-        system_instruction=CONVERSATION_SYSTEM_PROMPT,
-        response_mime_type="application/json",
-        response_schema=CONVERSATION_SCHEMA
-    )
+    def build_prompt(n):
+        return (
+            f"Generate {n} unique ideas for short Finnish conversations, following the specified JSON structure exactly."
+        )
 
-    full_prompt = (
-        f"Generate {NUM_CONVERSATION_IDEAS} unique ideas for short Finnish conversations, following the specified JSON structure exactly."
+    data = await generate_idea_batches(
+        MODEL_NAME_CONVERSATION, CONVERSATION_CONFIG, "ideas", NUM_CONVERSATION_IDEAS, build_prompt,
+        use_batch_api=use_batch_api,
     )
-
-    response = client.models.generate_content(
-        model=MODEL_NAME_CONVERSATION,
-        contents=[full_prompt],
-        config=config,
-    )
-
-    data = json.loads(response.text)
     data["ideas"] = assign_voice_ids(data.get("ideas", []))
     return data, "ideas.json"
 
@@ -303,27 +440,26 @@ Rules:
 - Only fill in the string values.
 """
 
-def generate_podcast_ideas():
-    print(f"🪄 Generating {NUM_PODCAST_IDEAS} podcast lesson ideas...")
-    if not client: return None
+# Built once at import and reused for every request
+PODCAST_CONFIG = types.GenerateContentConfig(
+    system_instruction=PODCAST_SYSTEM_PROMPT,
+    response_mime_type="application/json",
+    response_schema=PODCAST_SCHEMA
+)
 
-    config = types.GenerateContentConfig(
-        system_instruction=PODCAST_SYSTEM_PROMPT,
-        response_mime_type="application/json",
-        response_schema=PODCAST_SCHEMA
-    )
+async def generate_podcast_ideas(use_batch_api=False):
+    print(f"🪄 Generating {NUM_PODCAST_IDEAS} podcast lesson ideas...")
+    if not get_genai_client(): return None
 
-    full_prompt = (
-        f"Generate {NUM_PODCAST_IDEAS} unique, creative, and highly useful podcast ideas for Finnish beginners, following the specified JSON structure exactly. Remember to use only the allowed character names."
-    )
+    def build_prompt(n):
+        return (
+            f"Generate {n} unique, creative, and highly useful podcast ideas for Finnish beginners, following the specified JSON structure exactly. Remember to use only the allowed character names."
+        )
 
-    response = client.models.generate_content(
-        model=MODEL_NAME_PODCAST,
-        contents=[full_prompt],
-        config=config,
+    data = await generate_idea_batches(
+        MODEL_NAME_PODCAST, PODCAST_CONFIG, "podcast_ideas", NUM_PODCAST_IDEAS, build_prompt,
+        use_batch_api=use_batch_api,
     )
-
-    data = json.loads(response.text)
     # **MODIFICATION HERE**: Use the new specific voice assignment function
     data["podcast_ideas"] = assign_podcast_voice_ids(data.get("podcast_ideas", [])) 
     return data, "podcast_ideas.json"
@@ -331,23 +467,24 @@ def generate_podcast_ideas():
 # --- MAIN EXECUTION (No Change) ---
 
 def main():
-    if not client:
+    if not get_genai_client():
         print("🛑 Cannot run generation. Please ensure 'google-genai' is installed and 'GEMINI_API_KEY' is set in your .env file.")
         return
 
-    # Check for command-line argument
-    if len(sys.argv) > 1 and sys.argv[1].lower() == 'podcast':
-        result, output_file = generate_podcast_ideas()
+    # Check for command-line arguments: an optional 'podcast' mode and a '--batch' flag
+    args = [arg.lower() for arg in sys.argv[1:]]
+    use_batch_api = '--batch' in args
+    if 'podcast' in args:
+        result, output_file = asyncio.run(generate_podcast_ideas(use_batch_api))
         idea_count = NUM_PODCAST_IDEAS
     else:
         # Default behavior: generate conversations
-        result, output_file = generate_conversation_ideas()
+        result, output_file = asyncio.run(generate_conversation_ideas(use_batch_api))
         idea_count = NUM_CONVERSATION_IDEAS
 
     if result:
         try:
-            with open(output_file, "w", encoding="utf-8") as f:
-                json.dump(result, f, ensure_ascii=False, indent=2)
+            json_utils.dump_file(result, output_file)
             print(f"✅ {idea_count} ideas saved to **{output_file}**")
         except Exception as e:
             print(f"❌ An error occurred while saving the file: {e}")
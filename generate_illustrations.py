@@ -1,30 +1,75 @@
+import asyncio
+import functools
+import hashlib
 import os
-import json
+import random
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 from PIL import Image
 from dotenv import load_dotenv
 from google import genai
 from google.genai import types
+from google.genai.errors import APIError
+
+import cache_utils
+import json_utils
 
 # --- Load environment variables ---
 load_dotenv()
 
 # --- Gemini Client Initialization ---
 # The client automatically looks for the GEMINI_API_KEY environment variable.
-try:
-    # Initialize client once
-    client = genai.Client()
-    print("✅ Gemini client initialized.")
-except Exception as e:
-    print(f"❌ Error initializing Gemini client: {e}")
-    print("Please ensure you have set the GEMINI_API_KEY environment variable.")
-    # Exit if the client cannot be initialized due to missing key or other error
-    exit()
+# It is created on first use and cached, so every request shares one connection pool.
+@functools.lru_cache(maxsize=1)
+def get_genai_client():
+    try:
+        client = genai.Client()
+        print("✅ Gemini client initialized.")
+        return client
+    except Exception as e:
+        print(f"❌ Error initializing Gemini client: {e}")
+        print("Please ensure you have set the GEMINI_API_KEY environment variable.")
+        # Exit if the client cannot be initialized due to missing key or other error
+        exit()
 
 # --- Configuration ---
 INPUT_DIR = "scripts"
 OUTPUT_DIR = "illustrations"
 MODEL_NAME = "gemini-2.5-flash-image"
+# Maximum number of illustration requests in flight at once (keep within your Gemini rate limit)
+MAX_CONCURRENT_REQUESTS = 8
+# Transient Gemini failures (rate limiting, server errors) are retried with exponential
+# backoff and full jitter; other errors (e.g. blocked prompts) fail immediately
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+MAX_RETRIES = 5
+MAX_BACKOFF_SECONDS = 30
+# Output image format (PNG, WEBP or JPEG). PNG uses a fast compression level; WebP is much
+# smaller on disk at visually lossless quality.
+ILLUSTRATION_FORMAT = os.getenv("ILLUSTRATION_FORMAT", "PNG").upper()
+if ILLUSTRATION_FORMAT == "JPG":
+    ILLUSTRATION_FORMAT = "JPEG"
+SAVE_OPTIONS = {
+    "PNG": {"compress_level": 1},
+    "WEBP": {"quality": 90, "method": 4},
+    "JPEG": {"quality": 90},
+}
+if ILLUSTRATION_FORMAT not in SAVE_OPTIONS:
+    raise SystemExit(
+        f"❌ Unsupported ILLUSTRATION_FORMAT {ILLUSTRATION_FORMAT!r}; use one of: {', '.join(SAVE_OPTIONS)}"
+    )
+ILLUSTRATION_EXT = ".jpg" if ILLUSTRATION_FORMAT == "JPEG" else "." + ILLUSTRATION_FORMAT.lower()
+ILLUSTRATION_MIME_TYPE = "image/" + ILLUSTRATION_FORMAT.lower()
+# Bounded worker pool for image decode/encode, so saving finished images overlaps with
+# requests still in flight without running an unbounded number of PIL jobs at once
+POOL = ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1))
+# Generated images are also kept here, keyed by a hash of the request, so unchanged scripts
+# are not sent to Gemini again. The oldest entries are evicted once the cap is exceeded.
+CACHE_DIR = os.path.join(OUTPUT_DIR, ".cache")
+CACHE_MAX_BYTES = int(os.getenv("ILLUSTRATION_CACHE_MAX_MB", "500")) * 1024 * 1024
+
+# Number of dialogue words quoted in the prompt to convey the mood
+SAMPLE_DIALOGUE_WORDS = 40
 
 # --- Fixed illustration style description ---
 ILLUSTRATION_STYLE = (
@@ -36,6 +81,14 @@ ILLUSTRATION_STYLE = (
     "Backgrounds are simplified, using color blocks and minimal object representation to provide context without distraction."
 )
 
+# Static start of every illustration prompt. Keeping it identical and first lets Gemini
+# reuse the prefix across requests; only the scene-specific tail varies.
+ILLUSTRATION_PROMPT_PREFIX = (
+    "Create a visually engaging digital illustration. "
+    f"{ILLUSTRATION_STYLE} "
+    "Do not include any text or captions in the image. Ensure the image is a single, clear illustration. "
+)
+
 ## 🏗️ Core Functions
 
 ### 1. Prompt Generation
@@ -56,16 +109,20 @@ def create_generic_prompt(data: dict) -> str:
     characters = idea.get("characters", [])
     character_names = ", ".join([c.get("name", "Unnamed") for c in characters])
 
-    # Sample dialogue preview
-    all_lines = " ".join([d.get("text", "") for d in dialogues])
-    sample_dialogue_words = all_lines.split()[:40]
-    sample_dialogue = " ".join(sample_dialogue_words) + ("..." if len(all_lines.split()) > 40 else "")
+    # Sample dialogue preview: collect only the first SAMPLE_DIALOGUE_WORDS words
+    sample_dialogue_words, truncated = [], False
+    for d in dialogues:
+        for word in d.get("text", "").split():
+            if len(sample_dialogue_words) >= SAMPLE_DIALOGUE_WORDS:
+                truncated = True
+                break
+            sample_dialogue_words.append(word)
+        if truncated:
+            break
+    sample_dialogue = " ".join(sample_dialogue_words) + ("..." if truncated else "")
 
     # Build generic illustration prompt
-    prompt = (
-        f"Create a visually engaging digital illustration. "
-        f"{ILLUSTRATION_STYLE} "
-        f"Do not include any text or captions in the image. Ensure the image is a single, clear illustration. "
+    prompt = ILLUSTRATION_PROMPT_PREFIX + (
         f"The language of the script is {language}, and the tone is {tone}. "
         f"Scene description: {description or 'No explicit description provided.'} "
         #f"Characters involved: {character_names or 'unspecified characters'}. "
@@ -75,24 +132,75 @@ def create_generic_prompt(data: dict) -> str:
 
     return prompt
 
-def generate_illustration_from_json(json_path: str, aspect_ratio: str = "9:16"):
+def save_image(image_data: bytes, mime_type: str, output_path: str):
+    """Write the returned image to `output_path`, re-encoding only if its format differs."""
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    if mime_type == ILLUSTRATION_MIME_TYPE:
+        # Already in the requested format: store Gemini's bytes as-is
+        with open(output_path, "wb") as f:
+            f.write(image_data)
+        return
+
+    image = Image.open(BytesIO(image_data))
+    if ILLUSTRATION_FORMAT == "JPEG" and image.mode not in ("RGB", "L"):
+        # JPEG has no alpha channel
+        image = image.convert("RGB")
+    image.save(output_path, format=ILLUSTRATION_FORMAT, **SAVE_OPTIONS[ILLUSTRATION_FORMAT])
+
+def illustration_cache_path(prompt: str, aspect_ratio: str) -> str:
+    """Return the cache file for an image generated from this exact request."""
+    key = hashlib.sha256(f"{MODEL_NAME}\0{aspect_ratio}\0{prompt}".encode("utf-8")).hexdigest()
+    return os.path.join(CACHE_DIR, key + ILLUSTRATION_EXT)
+
+async def generate_content_with_retry(**kwargs):
+    """Call Gemini, retrying rate-limit and server errors with jittered exponential backoff."""
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return await get_genai_client().aio.models.generate_content(**kwargs)
+        except APIError as e:
+            if e.code not in RETRYABLE_STATUS_CODES or attempt == MAX_RETRIES:
+                raise
+            delay = random.uniform(0, min(MAX_BACKOFF_SECONDS, 2 ** attempt))
+            print(f"🔁 Gemini returned {e.code}, retrying in {delay:.1f}s ({attempt + 1}/{MAX_RETRIES})")
+            await asyncio.sleep(delay)
+
+async def generate_illustration_from_json(json_path: str, aspect_ratio: str = "9:16", force: bool = False):
     """
     Generate an illustration for one JSON script using Gemini.
 
     :param json_path: Path to the input JSON file.
     :param aspect_ratio: The desired aspect ratio for the generated image.
+    :param force: Regenerate even if the output image already exists, bypassing the cache.
     """
+    # --- MODIFICATION START ---
+    base_filename = os.path.splitext(os.path.basename(json_path))[0]
+    output_filename = "conversation_" + base_filename + ILLUSTRATION_EXT
+    # --- MODIFICATION END ---
+    output_path = os.path.join(OUTPUT_DIR, output_filename)
+
+    if not force and os.path.exists(output_path):
+        print(f"⏭️ Skipping {os.path.basename(json_path)}: {output_path} already exists")
+        return
+
     try:
-        with open(json_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        data = json_utils.load_file(json_path)
     except FileNotFoundError:
         print(f"❌ Error: File not found at {json_path}")
         return
-    except json.JSONDecodeError:
+    except json_utils.JSONDecodeError:
         print(f"❌ Error: Invalid JSON format in {json_path}")
         return
 
     prompt = create_generic_prompt(data)
+
+    cache_path = illustration_cache_path(prompt, aspect_ratio)
+    # A forced run always asks for a fresh image; the result still replaces the cache entry
+    if not force and os.path.exists(cache_path):
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
+        await asyncio.to_thread(cache_utils.copy_from_cache, cache_path, output_path)
+        print(f"♻️ Reused cached illustration for {os.path.basename(json_path)}: {output_path}")
+        return
+
     print(f"\n🎨 Generating illustration for: {os.path.basename(json_path)}")
 
     # --- GenerateContentConfig ---
@@ -105,7 +213,7 @@ def generate_illustration_from_json(json_path: str, aspect_ratio: str = "9:16"):
     )
 
     try:
-        response = client.models.generate_content(
+        response = await generate_content_with_retry(
             model=MODEL_NAME,
             contents=[prompt],
             config=config
@@ -137,42 +245,60 @@ def generate_illustration_from_json(json_path: str, aspect_ratio: str = "9:16"):
         if part.inline_data is not None:
             image_data = part.inline_data.data
 
+            # Decode/encode in the worker pool so the event loop keeps serving other requests
             try:
-                image = Image.open(BytesIO(image_data))
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(POOL, save_image, image_data, part.inline_data.mime_type, output_path)
             except Exception as e:
                 print(f"❌ Error opening image data for {os.path.basename(json_path)}: {e}")
                 continue
 
-            os.makedirs(OUTPUT_DIR, exist_ok=True)
-            # --- MODIFICATION START ---
-            base_filename = os.path.splitext(os.path.basename(json_path))[0]
-            output_filename = "conversation_" + base_filename + ".png"
-            # --- MODIFICATION END ---
-            output_path = os.path.join(OUTPUT_DIR, output_filename)
-
-            image.save(output_path)
             print(f"✅ Image saved to {output_path}")
+
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            await asyncio.to_thread(cache_utils.store_in_cache, output_path, cache_path)
             return # Assuming only one image is desired per script
 
     print(f"⚠️ No image data found in model response parts for {os.path.basename(json_path)}. Check API logs.")
 
-def main():
-    """Main function to process all JSON scripts and generate illustrations."""
+async def main(force: bool = False):
+    """Main function to process all JSON scripts and generate illustrations concurrently.
+
+    Scripts that already have an illustration are skipped unless `force` is set.
+    """
 
     # Create the input directory if it doesn't exist for clarity
     os.makedirs(INPUT_DIR, exist_ok=True)
 
     # Process all JSON files in the scripts/ directory
-    files = [f for f in os.listdir(INPUT_DIR) if f.endswith(".json")]
+    with os.scandir(INPUT_DIR) as it:
+        files = [e.path for e in it if e.is_file() and e.name.endswith(".json")]
 
     if not files:
         print(f"⚠️ No JSON files found in {INPUT_DIR}/. Create some script JSON files to begin.")
         return
 
-    for file in files:
-        json_path = os.path.join(INPUT_DIR, file)
-        generate_illustration_from_json(json_path, aspect_ratio="9:16")
+    get_genai_client()  # Fail fast before dispatching if the client can't be created
+
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+    failed = []
+
+    async def run(json_path):
+        # One malformed script must not abort the images still being generated for the rest
+        try:
+            async with semaphore:
+                await generate_illustration_from_json(json_path, aspect_ratio="9:16", force=force)
+        except Exception as e:
+            print(f"❌ Failed to illustrate {os.path.basename(json_path)}: {e}")
+            failed.append(json_path)
+
+    await asyncio.gather(*(run(json_path) for json_path in files))
+    cache_utils.prune_cache(CACHE_DIR, CACHE_MAX_BYTES)
+
+    if failed:
+        print(f"⚠️ {len(failed)} of {len(files)} script(s) failed: {', '.join(os.path.basename(p) for p in failed)}")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    asyncio.run(main(force="--force" in sys.argv[1:]))
\ No newline at end of file
@@ -1,24 +1,33 @@
+import asyncio
+import functools
 import os
-import json
 import random
 from google import genai
 from google.genai import types
 from dotenv import load_dotenv
 
+import json_utils
+
 # Load environment variables
 load_dotenv()
 
 # Initialize the Gemini client (uses GEMINI_API_KEY from .env)
 # Note: You may need to replace 'genai.Client()' with 'google.genai.Client()' depending on your exact library version.
-try:
-    client = genai.Client()
-except AttributeError:
-    print("Warning: Could not initialize genai.Client. Check your library installation.")
-    client = None # Handle case where client initialization fails
+# The client is created on first use and cached, so repeated calls reuse its connection pool.
+@functools.lru_cache(maxsize=1)
+def get_genai_client():
+    try:
+        return genai.Client()
+    except AttributeError:
+        print("Warning: Could not initialize genai.Client. Check your library installation.")
+        return None # Handle case where client initialization fails
 
 # ---- CONFIG ----
 OUTPUT_FILE = "podcast_ideas.json"
 NUM_IDEAS = 3  # how many podcast ideas to generate
+IDEAS_PER_REQUEST = 10  # larger runs are split into parallel requests of this size
+# Dedicated RNG for voice assignment; set VOICE_SEED for reproducible picks
+_RNG = random.Random(os.getenv("VOICE_SEED"))
 MODEL_NAME = "gemini-2.5-flash"  # A robust model for strict JSON output
 
 # Voice pool (Keeping the original for character assignment)
@@ -43,6 +52,11 @@ VOICES = [
     },
 ]
 
+# Index the voice pool by gender once at import instead of filtering VOICES per character
+VOICES_BY_GENDER = {}
+for _voice in VOICES:
+    VOICES_BY_GENDER.setdefault(_voice["gender"].lower(), []).append(_voice)
+
 # ---- PROMPT MODIFICATIONS ----
 SYSTEM_PROMPT = """You are a highly creative script idea generator for short (3-5 minute) educational podcasts aimed at absolute beginners learning Finnish.
 The ideas must focus on either a single, highly useful beginner Finnish tip (e.g., a grammar shortcut, a cultural concept, or a pronunciation trick) OR a small set of immediately useful phrases for a specific situation.
@@ -143,7 +157,8 @@ JSON_EXAMPLE = """
 }
 """
 
-def generate_ideas():
+async def generate_ideas():
+    client = get_genai_client()
     if not client:
         print("Cannot run generation without a valid Gemini Client.")
         return None
@@ -154,26 +169,32 @@ def generate_ideas():
         response_schema=response_schema
     )
 
-    full_prompt = (
-        f"Generate {NUM_IDEAS} unique, creative, and highly useful podcast ideas for Finnish beginners, following the new schema exactly:\n"
-        f"{JSON_EXAMPLE}"
-    )
+    async def generate_shard(n):
+        full_prompt = (
+            f"Generate {n} unique, creative, and highly useful podcast ideas for Finnish beginners, following the new schema exactly:\n"
+            f"{JSON_EXAMPLE}"
+        )
 
-    response = client.models.generate_content(
-        model=MODEL_NAME,
-        contents=[full_prompt],
-        config=config,
-    )
+        response = await client.aio.models.generate_content(
+            model=MODEL_NAME,
+            contents=[full_prompt],
+            config=config,
+        )
+
+        raw_json = response.text
+        return json_utils.loads(raw_json)
 
-    raw_json = response.text
-    data = json.loads(raw_json)
+    # Request the shards concurrently and merge their idea lists into the first one
+    sizes = [min(IDEAS_PER_REQUEST, NUM_IDEAS - start) for start in range(0, NUM_IDEAS, IDEAS_PER_REQUEST)]
+    shards = await asyncio.gather(*(generate_shard(n) for n in sizes))
+    data = shards[0]
+    data["podcast_ideas"] = [idea for shard in shards for idea in shard.get("podcast_ideas", [])]
 
     # Assign voice IDs to characters
     for idea in data.get("podcast_ideas", []): # Changed key to 'podcast_ideas'
         for char in idea["characters"]:
             # Logic to select a voice based on gender
-            possible_voices = [v for v in VOICES if v["gender"].lower() == char["gender"].lower()]
-            voice = random.choice(possible_voices) if possible_voices else random.choice(VOICES)
+            voice = _RNG.choice(VOICES_BY_GENDER.get(char["gender"].lower()) or VOICES)
             char["voice_id"] = voice["voice_id"]
 
     return data
@@ -181,10 +202,9 @@ def generate_ideas():
 if __name__ == "__main__":
     print("🪄 Generating creative Finnish beginner podcast ideas using Gemini...")
     try:
-        result = generate_ideas()
+        result = asyncio.run(generate_ideas())
         if result:
-            with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
-                json.dump(result, f, ensure_ascii=False, indent=2)
+            json_utils.dump_file(result, OUTPUT_FILE)
             print(f"✅ {NUM_IDEAS} podcast ideas saved to {OUTPUT_FILE}")
     except Exception as e:
         print(f"❌ An error occurred during generation: {e}")
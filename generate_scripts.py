@@ -1,59 +1,109 @@
+import asyncio
+import functools
+import hashlib
 import json
 import os
 import re
 import sys # Added for easier argument handling
+import time
 from dotenv import load_dotenv
-# --- Import the new Google GenAI SDK components ---
-from google import genai
-from google.genai import types 
-from google.genai.errors import APIError
+
+import json_utils
+
+# google.genai is imported lazily inside the functions that need them, so
+# argument handling and file checks don't pay for loading the SDK.
 
 # --- Load environment variables ---
 load_dotenv()
-# Change to GEMINI_API_KEY
-api_key = os.getenv("GEMINI_API_KEY") 
 
-if not api_key:
-    # Update error message and variable check
-    raise ValueError("❌ GEMINI_API_KEY not found. Please add it to your .env file.")
+# Maximum number of Gemini requests in flight at once (keeps us under the RPM quota)
+MAX_CONCURRENT_REQUESTS = 8
+
+
+@functools.lru_cache(maxsize=1)
+def get_genai_client():
+    """Create the Gemini client on first use and reuse it for the rest of the run."""
+    from google import genai
+
+    # Change to GEMINI_API_KEY
+    api_key = os.getenv("GEMINI_API_KEY") 
 
-# Initialize Gemini client
-# The Client constructor takes the API key directly.
-client = genai.Client(api_key=api_key) 
+    if not api_key:
+        # Update error message and variable check
+        raise ValueError("❌ GEMINI_API_KEY not found. Please add it to your .env file.")
+
+    # The Client constructor takes the API key directly.
+    return genai.Client(api_key=api_key)
+
+# Model used for both conversation and podcast scripts (supports JSON mode)
+MODEL_NAME = "gemini-2.5-flash"
+SCRIPT_TEMPERATURE = 0.8
+
+# Local cache of successful responses, so re-runs skip ideas that were already generated
+LLM_CACHE_DIR = ".llm_cache"
+LLM_CACHE_TTL_SECONDS = 7 * 24 * 60 * 60  # one week
 
 # --- Helper Functions (unchanged) ---
 
+# Compiled once at import instead of going through re's pattern cache on every call
+_SLUG_RE = re.compile(r'[^a-z0-9]+')
+
 def slugify(title):
     """Convert a title into a safe filename."""
-    return re.sub(r'[^a-z0-9]+', '-', title.lower()).strip('-')
+    return _SLUG_RE.sub('-', title.lower()).strip('-')
+
+
+def response_cache_key(**parts):
+    """Build a stable SHA256 key from the JSON-serialisable parts of a request."""
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def load_cached_response(key):
+    """Return the cached response for `key`, or None if missing or expired."""
+    cache_path = os.path.join(LLM_CACHE_DIR, f"{key}.json")
+    try:
+        if time.time() - os.path.getmtime(cache_path) > LLM_CACHE_TTL_SECONDS:
+            return None
+        return json_utils.load_file(cache_path)
+    except (OSError, json_utils.JSONDecodeError):
+        return None
+
+
+def store_cached_response(key, data):
+    """Save a successful response under `key`. Cache write failures are not fatal."""
+    try:
+        os.makedirs(LLM_CACHE_DIR, exist_ok=True)
+        json_utils.dump_file(data, os.path.join(LLM_CACHE_DIR, f"{key}.json"), indent=False)
+    except OSError as e:
+        print(f"⚠️ Could not write response cache: {e}")
 
 
 # --- Core Logic: Updated to use Gemini API ---
 
-def generate_conversation(idea, metadata):
-    """Call Gemini to generate a conversation script in the required JSON array format."""
-    
-    # 1. Prepare the Character Map for the LLM (Unchanged)
-    characters = idea.get("characters", [])
-    if not characters:
-        raise ValueError("Idea must contain a 'characters' list with 'name' and 'voice_id'.")
-    
-    # Create a simple map for the LLM to reference voice IDs
-    char_map = {
-        c['name']: {
-            'voice_id': c.get('voice_id', f"VOICE_ID_PLACEHOLDER_{i}"), # Use real IDs if available
-            'gender': c.get('gender', 'unknown'),
-            'tone': c.get('default_tone', 'neutral')
-        } for i, c in enumerate(characters)
-    }
-    
-    char_info_text = "\n".join(
-        [f"- {name} (Gender: {info['gender']}, Default Tone: {info['tone']}, Voice ID: {info['voice_id']})" for name, info in char_map.items()]
-    )
-    
-    # 2. Build the detailed prompt instructing for JSON output (Unchanged)
-    # The system instruction for strictly valid JSON is crucial for models that support it.
-    prompt = f"""
+async def stream_response_text(model, contents, config):
+    """Stream a Gemini response and return the full text once the stream closes."""
+    chunks = []
+    usage = None
+    async for chunk in await get_genai_client().aio.models.generate_content_stream(
+        model=model,
+        contents=contents,
+        config=config,
+    ):
+        if chunk.text:
+            chunks.append(chunk.text)
+        if chunk.usage_metadata:
+            usage = chunk.usage_metadata
+
+    # Report prompt-cache hits so prefix changes that break caching are easy to spot
+    if usage and usage.cached_content_token_count:
+        print(f"⚡ {usage.cached_content_token_count}/{usage.prompt_token_count} prompt tokens served from cache")
+    return "".join(chunks)
+
+
+# Everything in the conversation prompt that does not depend on the idea. Keeping it
+# byte-identical at the start of every request maximises implicit prefix-cache hits.
+CONVERSATION_PROMPT_PREFIX = """
         You are a Finnish dialogue writer. Your task is to generate a short (1–2 minutes) natural and realistic conversation 
         based on the provided idea.
 
@@ -61,26 +111,162 @@ def generate_conversation(idea, metadata):
         The 'dialogue_list' must be a JSON array of objects, where each object represents a dialogue line 
         formatted exactly for the ElevenLabs text-to-dialogue API.
 
-        Characters:
-        {char_info_text}
-
         JSON Output Format Specification:
         The final output must be a JSON object like this:
-        {{
+        {
         "dialogue_list": [
-            {{
+            {
             "text": "[emotion] Dialogue line, including sound cues like [sigh] or [laugh].",
-            "voice_id": "The specific voice_id for this character from the list above."
-            }},
+            "voice_id": "The specific voice_id for this character from the Characters list."
+            },
             // ... more dialogue objects
         ]
-        }}
+        }
 
         Instructions:
-        - Use the **exact** 'voice_id' provided in the Characters list for each line.
+        - Use the **exact** 'voice_id' provided in the Characters list below for each line.
         - The 'text' field must start with an emotion/tone in brackets (e.g., [calm], [excited]).
         - Keep the speech natural, expressive, and varied.
         - Match each character's tone and personality.
+"""
+
+
+# The podcast equivalent. The audience is described generically here; the exact
+# target_audience value is part of the per-idea Metadata block.
+PODCAST_PROMPT_PREFIX = """
+        You are an expert Finnish language podcast scriptwriter. Your task is to generate an engaging, 
+        instructional podcast script based on the provided concept and characters.
+
+        The output MUST be a single JSON object containing a key called 'dialogue_list'.
+        The 'dialogue_list' must be a JSON array of objects, where each object represents a dialogue line 
+        formatted exactly for the ElevenLabs text-to-dialogue API.
+
+        The script should be a **language lesson** and must include clear explanations and examples based on the concept.
+        The **main language** of the script must be **English**, with Finnish phrases and vocabulary introduced, 
+        explained, and repeated for the lesson. This is crucial as the target audience (given in the Metadata below) is Finnish beginners.
+
+        JSON Output Format Specification:
+        The final output must be a JSON object like this:
+        {
+        "dialogue_list": [
+            {
+            "text": "[emotion] Dialogue line, including sound cues like [sigh] or [laugh].",
+            "voice_id": "The specific voice_id for this character from the Characters list."
+            },
+            // ... more dialogue objects
+        ]
+        }
+
+        Instructions:
+        - Use the **exact** 'voice_id' provided in the Characters list below for each line.
+        - The 'text' field must start with an emotion/tone in brackets (e.g., [calm], [excited]).
+        - The script must clearly deliver the lesson outlined in the concept.
+        - **STRICTLY:** The vast majority (85%+) of the dialogue should be in English. Introduce and explain Finnish words/phrases clearly.
+        - Ensure the total duration aligns with the metadata length.
+"""
+
+
+CONVERSATION_SYSTEM_INSTRUCTION = "You are a creative Finnish dialogue writer who writes expressive, natural speech, and you strictly output only valid JSON."
+PODCAST_SYSTEM_INSTRUCTION = "You are an expert Finnish language podcast scriptwriter who writes instructional, engaging dialogue and strictly outputs only valid JSON."
+
+# Static (system instruction, prompt prefix) per script type. The prefix goes ahead of every
+# request's per-idea tail, so Gemini's implicit prefix cache can serve it.
+SCRIPT_PROMPTS = {
+    'conversation': (CONVERSATION_SYSTEM_INSTRUCTION, CONVERSATION_PROMPT_PREFIX),
+    'podcast': (PODCAST_SYSTEM_INSTRUCTION, PODCAST_PROMPT_PREFIX),
+}
+
+# Both script types return the same shape. Constraining decoding to it means the model
+# can't emit malformed JSON that would waste the whole request. A plain dict keeps
+# google.genai out of module import.
+SCRIPT_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "dialogue_list": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "text": {"type": "string"},
+                    "voice_id": {"type": "string"},
+                },
+                "required": ["text", "voice_id"],
+            },
+        },
+    },
+    "required": ["dialogue_list"],
+}
+
+def build_script_request(script_type, tail):
+    """Return (contents, config) for a script request whose per-idea part is `tail`."""
+    from google.genai import types
+
+    system_instruction, prefix = SCRIPT_PROMPTS[script_type]
+    return prefix + tail, types.GenerateContentConfig(
+        # Set the generation temperature
+        temperature=SCRIPT_TEMPERATURE,
+        # Enforce JSON output!
+        response_mime_type="application/json",
+        response_schema=SCRIPT_RESPONSE_SCHEMA,
+        # Pass the system instruction for model behavior
+        system_instruction=system_instruction,
+    )
+
+
+@functools.lru_cache(maxsize=64)
+def _build_char_info(chars_json, script_type):
+    """Render the Characters block of the prompt, memoised on the serialised character list.
+
+    Ideas in one file often share the same cast, so identical lists are rendered once.
+    """
+    characters = json.loads(chars_json)
+    if script_type == 'podcast':
+        return "\n".join(
+            [f"- {c['name']} (Role: {c['role']}, Tone: {c['default_tone']}, Voice ID: {c['voice_id']})" for c in characters]
+        )
+
+    # Create a simple map for the LLM to reference voice IDs
+    char_map = {
+        c['name']: {
+            'voice_id': c.get('voice_id', f"VOICE_ID_PLACEHOLDER_{i}"), # Use real IDs if available
+            'gender': c.get('gender', 'unknown'),
+            'tone': c.get('default_tone', 'neutral')
+        } for i, c in enumerate(characters)
+    }
+    
+    return "\n".join(
+        [f"- {name} (Gender: {info['gender']}, Default Tone: {info['tone']}, Voice ID: {info['voice_id']})" for name, info in char_map.items()]
+    )
+
+
+def script_cache_key(script_type, tail):
+    """Key a script request on everything that shapes its output: model, config and full prompt."""
+    system_instruction, prefix = SCRIPT_PROMPTS[script_type]
+    return response_cache_key(
+        model=MODEL_NAME,
+        temperature=SCRIPT_TEMPERATURE,
+        response_schema=SCRIPT_RESPONSE_SCHEMA,
+        system_instruction=system_instruction,
+        prompt=prefix + tail,
+    )
+
+
+async def generate_conversation(idea, metadata, force=False):
+    """Call Gemini to generate a conversation script in the required JSON array format."""
+    from google.genai.errors import APIError
+    
+    # 1. Prepare the Character Map for the LLM (Unchanged)
+    characters = idea.get("characters", [])
+    if not characters:
+        raise ValueError("Idea must contain a 'characters' list with 'name' and 'voice_id'.")
+    
+    char_info_text = _build_char_info(json.dumps(characters, sort_keys=True), 'conversation')
+    
+    # 2. Build the per-idea part of the prompt. It follows the static prefix, which is
+    # sent first so Gemini can serve it from its implicit prompt cache.
+    prompt_tail = f"""
+        Characters:
+        {char_info_text}
 
         Metadata:
         Language: {metadata.get('language', 'Finnish')}
@@ -94,22 +280,22 @@ def generate_conversation(idea, metadata):
         Generate the full conversation in the specified JSON format.
     """
     
+    # Serve repeated prompts from the local cache instead of paying for another API call
+    cache_key = script_cache_key('conversation', prompt_tail)
+    cached = None if force else load_cached_response(cache_key)
+    if cached is not None:
+        print(f"♻️ Using cached conversation for: {idea['title']}")
+        return cached
+
     # --- Gemini API Call Changes ---
     try:
         # Configuration for the API call
-        config = types.GenerateContentConfig(
-            # Set the generation temperature
-            temperature=0.8,
-            # Enforce JSON output!
-            response_mime_type="application/json",
-            # Pass the system instruction for model behavior
-            system_instruction="You are a creative Finnish dialogue writer who writes expressive, natural speech, and you strictly output only valid JSON."
-        )
+        contents, config = build_script_request('conversation', prompt_tail)
 
         # Call the Gemini API. Use a model supporting JSON output, like gemini-2.5-flash.
-        response = client.models.generate_content(
-            model='gemini-2.5-flash', # A powerful model supporting JSON mode
-            contents=prompt,
+        response_text = await stream_response_text(
+            model=MODEL_NAME,
+            contents=contents,
             config=config,
         )
 
@@ -117,66 +303,36 @@ def generate_conversation(idea, metadata):
         print(f"❌ Error during Gemini API call: {e}")
         return {"dialogue_list": [], "error": f"API Error: {e}"}
 
-    # The response content is a JSON string in a special 'text' field.
-    json_string = response.text.strip()
-    
+    # The response content is a JSON string assembled from the streamed 'text' chunks.
+    # The parser skips surrounding whitespace itself, so no stripped copy is needed.
     try:
         # Parse the JSON string and return
-        json_output = json.loads(json_string)
+        json_output = json_utils.loads(response_text)
+        if json_output.get("dialogue_list"):
+            store_cached_response(cache_key, json_output)
         return json_output
-    except json.JSONDecodeError:
+    except json_utils.JSONDecodeError:
         print("❌ Error: Gemini did not return valid JSON despite the configuration.")
-        return {"dialogue_list": [], "error": json_string}
+        return {"dialogue_list": [], "error": response_text}
 
 # --- NEW Function for Podcast Script Generation ---
 
-def generate_podcast_script(idea, metadata):
+async def generate_podcast_script(idea, metadata, force=False):
     """Call Gemini to generate a podcast script for a language lesson, using the provided concept."""
+    from google.genai.errors import APIError
     
     # 1. Prepare Character Map (Updated to include Role and Concept)
     characters = idea.get("characters", [])
     if not characters:
         raise ValueError("Podcast idea must contain a 'characters' list with 'name' and 'voice_id'.")
     
-    char_info_text = "\n".join(
-        [f"- {c['name']} (Role: {c['role']}, Tone: {c['default_tone']}, Voice ID: {c['voice_id']})" for c in characters]
-    )
+    char_info_text = _build_char_info(json.dumps(characters, sort_keys=True), 'podcast')
     
-    # 2. Build the detailed prompt for a podcast script
-    prompt = f"""
-        You are an expert Finnish language podcast scriptwriter. Your task is to generate an engaging, 
-        instructional podcast script based on the provided concept and characters.
-
-        The output MUST be a single JSON object containing a key called 'dialogue_list'.
-        The 'dialogue_list' must be a JSON array of objects, where each object represents a dialogue line 
-        formatted exactly for the ElevenLabs text-to-dialogue API.
-
-        The script should be a **language lesson** and must include clear explanations and examples based on the concept.
-        The **main language** of the script must be **English**, with Finnish phrases and vocabulary introduced, 
-        explained, and repeated for the lesson. This is crucial as the target is a Finnish '{metadata['target_audience']}' (Beginner).
-
+    # 2. Build the per-idea part of the podcast prompt; the static prefix comes first
+    prompt_tail = f"""
         Characters:
         {char_info_text}
 
-        JSON Output Format Specification:
-        The final output must be a JSON object like this:
-        {{
-        "dialogue_list": [
-            {{
-            "text": "[emotion] Dialogue line, including sound cues like [sigh] or [laugh].",
-            "voice_id": "The specific voice_id for this character from the list above."
-            }},
-            // ... more dialogue objects
-        ]
-        }}
-
-        Instructions:
-        - Use the **exact** 'voice_id' provided in the Characters list for each line.
-        - The 'text' field must start with an emotion/tone in brackets (e.g., [calm], [excited]).
-        - The script must clearly deliver the lesson outlined in the concept.
-        - **STRICTLY:** The vast majority (85%+) of the dialogue should be in English. Introduce and explain Finnish words/phrases clearly.
-        - Ensure the total duration aligns with the metadata length.
-
         Metadata:
         Target Audience: {metadata['target_audience']}
         Duration: {metadata['duration']}
@@ -189,17 +345,19 @@ def generate_podcast_script(idea, metadata):
         Generate the full podcast script in the specified JSON format.
     """
     
+    cache_key = script_cache_key('podcast', prompt_tail)
+    cached = None if force else load_cached_response(cache_key)
+    if cached is not None:
+        print(f"♻️ Using cached podcast script for: {idea['title']}")
+        return cached
+
     # --- Gemini API Call ---
     try:
-        config = types.GenerateContentConfig(
-            temperature=0.8,
-            response_mime_type="application/json",
-            system_instruction="You are an expert Finnish language podcast scriptwriter who writes instructional, engaging dialogue and strictly outputs only valid JSON."
-        )
+        contents, config = build_script_request('podcast', prompt_tail)
 
-        response = client.models.generate_content(
-            model='gemini-2.5-flash',
-            contents=prompt,
+        response_text = await stream_response_text(
+            model=MODEL_NAME,
+            contents=contents,
             config=config,
         )
 
@@ -207,14 +365,14 @@ def generate_podcast_script(idea, metadata):
         print(f"❌ Error during Gemini API call: {e}")
         return {"dialogue_list": [], "error": f"API Error: {e}"}
 
-    json_string = response.text.strip()
-    
     try:
-        json_output = json.loads(json_string)
+        json_output = json_utils.loads(response_text)
+        if json_output.get("dialogue_list"):
+            store_cached_response(cache_key, json_output)
         return json_output
-    except json.JSONDecodeError:
+    except json_utils.JSONDecodeError:
         print("❌ Error: Gemini did not return valid JSON for the podcast script.")
-        return {"dialogue_list": [], "error": json_string}
+        return {"dialogue_list": [], "error": response_text}
 
 
 # --- Remaining Functions (Modified for flexibility) ---
@@ -245,20 +403,45 @@ def save_scripts(title, script_type, idea, metadata, conversation_data):
     }
 
     # Save to JSON
-    with open(json_path, "w", encoding="utf-8") as jf:
-        json.dump(full_json_data, jf, ensure_ascii=False, indent=2)
+    json_utils.dump_file(full_json_data, json_path)
 
     return json_path
 
-def process_ideas_file(filename, script_type, idea_key):
-    """Generic function to load ideas and process them."""
+async def generate_all(generator_func, ideas, metadata, script_type, force=False):
+    """Generate and save a script for every idea concurrently, bounded by MAX_CONCURRENT_REQUESTS.
+
+    Each script is written as soon as its response arrives, so disk writes overlap with
+    the requests still in flight. Results are returned in the same order as `ideas`; a
+    failed idea yields its exception instead of cancelling the rest of the batch.
+    """
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+    async def run(idea):
+        async with semaphore:
+            print(f"🪄 Generating {script_type} for: {idea['title']} ...")
+            conversation_data = await generator_func(idea, metadata, force=force)
+
+        # Write in a worker thread so the event loop keeps serving other responses
+        json_path = await asyncio.to_thread(
+            save_scripts, idea['title'], script_type, idea, metadata, conversation_data
+        )
+        print(f"✅ Saved JSON: {json_path}\n")
+        return json_path
+
+    return await asyncio.gather(*(run(idea) for idea in ideas), return_exceptions=True)
+
+
+def process_ideas_file(filename, script_type, idea_key, force=False):
+    """Generic function to load ideas and process them.
+
+    With `force`, cached responses are ignored and every script is regenerated.
+    """
     try:
-        with open(filename, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        data = json_utils.load_file(filename)
     except FileNotFoundError:
         print(f"❌ Error: {filename} not found. Please create it.")
         return
-    except json.JSONDecodeError:
+    except json_utils.JSONDecodeError:
         print(f"❌ Error: Could not decode JSON from {filename}.")
         return
 
@@ -267,26 +450,32 @@ def process_ideas_file(filename, script_type, idea_key):
 
     generator_func = generate_conversation if script_type == 'conversation' else generate_podcast_script
 
-    for idea in ideas:
-        print(f"🪄 Generating {script_type} for: {idea['title']} ...")
+    results = asyncio.run(generate_all(generator_func, ideas, metadata, script_type, force=force))
 
-        conversation_data = generator_func(idea, metadata) 
-        
-        json_path = save_scripts(idea['title'], script_type, idea, metadata, conversation_data)
-
-        print(f"✅ Saved JSON: {json_path}\n")
+    failed = []
+    for idea, result in zip(ideas, results):
+        if isinstance(result, Exception):
+            print(f"❌ Failed to generate {script_type} for '{idea['title']}': {result}\n")
+            failed.append(idea['title'])
 
-    print(f"🎉 All {script_type} scripts generated successfully!")
+    if not failed:
+        print(f"🎉 All {script_type} scripts generated successfully!")
+    else:
+        print(f"⚠️ {len(ideas) - len(failed)} {script_type} script(s) succeeded, {len(failed)} failed:")
+        for title in failed:
+            print(f"   - {title}")
 
 
 def main():
-    # Allow a command-line argument to specify which file to use
-    if len(sys.argv) > 1 and sys.argv[1].lower() == 'podcast':
+    # Allow command-line arguments to specify which file to use and to bypass the cache
+    args = [arg.lower() for arg in sys.argv[1:]]
+    force = '--force' in args
+    if 'podcast' in args:
         # New mode: Generate podcast scripts
-        process_ideas_file("podcast_ideas.json", "podcast", "podcast_ideas")
+        process_ideas_file("podcast_ideas.json", "podcast", "podcast_ideas", force=force)
     else:
         # Default mode: Generate standard conversations
-        process_ideas_file("ideas.json", "conversation", "ideas")
+        process_ideas_file("ideas.json", "conversation", "ideas", force=force)
 
 
 if __name__ == "__main__":
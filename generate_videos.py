@@ -1,74 +1,82 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from PIL import Image
 import subprocess
 
 # --- Configuration ---
 ILLUSTRATION_FOLDER = Path("illustrations")
 MP3_FOLDER = Path("mp3")
 OUTPUT_FOLDER = Path("output_videos")
-VIDEO_RESOLUTION = (720, 1280) 
+VIDEO_RESOLUTION = (720, 1280)
+# Number of ffmpeg encodes run side by side. Half the cores leaves room for each
+# encoder's own threads.
+MAX_WORKERS = max(1, (os.cpu_count() or 2) // 2)
 
-OUTPUT_FOLDER.mkdir(exist_ok=True)
+# Fit any illustration into VIDEO_RESOLUTION, keeping its aspect ratio and padding the rest
+_WIDTH, _HEIGHT = VIDEO_RESOLUTION
+SCALE_FILTER = (
+    f"scale={_WIDTH}:{_HEIGHT}:force_original_aspect_ratio=decrease,"
+    f"pad={_WIDTH}:{_HEIGHT}:(ow-iw)/2:(oh-ih)/2,setsar=1"
+)
 
-def prepare_image(image_path, target_size, temp_dir=Path("temp")):
-    temp_dir.mkdir(exist_ok=True)
-    
-    img = Image.open(image_path).convert("RGB")
-    img = img.resize(target_size)
-    temp_path = temp_dir / f"{Path(image_path).stem}_resized.png"
-    img.save(temp_path)
-    return temp_path
+def encode_one(name, image_path, audio_path):
+    """Render one still-image video for `name`. Runs in a worker thread."""
+    output_path = OUTPUT_FOLDER / f"{name}.mp4"
 
-# --- Main Loop ---
-illustration_files = {f.stem: f for f in ILLUSTRATION_FOLDER.iterdir() if f.is_file()}
-mp3_files = {f.stem: f for f in MP3_FOLDER.iterdir() if f.is_file() and f.suffix.lower() == ".mp3"}
-common_names = set(illustration_files.keys()) & set(mp3_files.keys())
-
-if not common_names:
-    print("No matching illustration and MP3 files found.")
-else:
-    print(f"Found {len(common_names)} matching pairs.")
+    try:
+        print(f"Processing: {name}")
 
-    temp_folder = Path("temp")
-    temp_folder.mkdir(exist_ok=True)
+        # Build FFmpeg command. The original illustration is read directly and fitted to
+        # the video resolution by ffmpeg's scale/pad filters, so no pre-processing is needed.
+        cmd = [
+            "ffmpeg",
+            "-y",  # overwrite output
+            "-loop", "1",
+            "-i", str(image_path),
+            "-i", str(audio_path),
+            "-vf", SCALE_FILTER,
+            "-c:v", "libx264",
+            "-tune", "stillimage",
+            "-c:a", "aac",
+            "-b:a", "192k",
+            "-pix_fmt", "yuv420p",
+            "-shortest",
+            str(output_path)
+        ]
 
-    for name in sorted(common_names):
-        image_path = illustration_files[name]
-        audio_path = mp3_files[name]
-        output_path = OUTPUT_FOLDER / f"{name}.mp4"
+        subprocess.run(cmd, check=True)
+        print(f"✅ Video saved: {output_path.name}")
 
-        try:
-            print(f"Processing: {name}")
+    except Exception as e:
+        print(f"❌ Error processing {name}: {e}")
 
-            # Prepare the image
-            temp_image = prepare_image(image_path, VIDEO_RESOLUTION, temp_folder)
+# --- Main Loop ---
+def main():
+    OUTPUT_FOLDER.mkdir(exist_ok=True)
 
-            # Build FFmpeg command
-            cmd = [
-                "ffmpeg",
-                "-y",  # overwrite output
-                "-loop", "1",
-                "-i", str(temp_image),
-                "-i", str(audio_path),
-                "-c:v", "libx264",
-                "-tune", "stillimage",
-                "-c:a", "aac",
-                "-b:a", "192k",
-                "-pix_fmt", "yuv420p",
-                "-shortest",
-                str(output_path)
-            ]
+    # scandir's DirEntry objects carry the file type from the directory listing itself
+    with os.scandir(ILLUSTRATION_FOLDER) as it:
+        illustration_files = {Path(e.name).stem: Path(e.path) for e in it if e.is_file()}
+    with os.scandir(MP3_FOLDER) as it:
+        mp3_files = {e.name[:-4]: Path(e.path) for e in it if e.is_file() and e.name.lower().endswith(".mp3")}
+    # Key views intersect directly, without copying either side into a new set first
+    common_names = illustration_files.keys() & mp3_files.keys()
 
-            subprocess.run(cmd, check=True)
-            print(f"✅ Video saved: {output_path.name}")
+    if not common_names:
+        print("No matching illustration and MP3 files found.")
+    else:
+        print(f"Found {len(common_names)} matching pairs.")
 
-        except Exception as e:
-            print(f"❌ Error processing {name}: {e}")
+        # ffmpeg does the heavy lifting in its own process, so threads are enough to
+        # keep several encodes running at once
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            submit = executor.submit
+            for name in sorted(common_names):
+                image_path = illustration_files[name]
+                audio_path = mp3_files[name]
+                submit(encode_one, name, image_path, audio_path)
 
-    # Cleanup temp images
-    for f in temp_folder.glob("*"):
-        f.unlink()
-    temp_folder.rmdir()
+    print("All videos generated!")
 
-print("All videos generated!")
+if __name__ == "__main__":
+    main()
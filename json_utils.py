@@ -0,0 +1,37 @@
+import json
+
+# orjson is a C extension that parses and serialises several times faster than the
+# stdlib. It is optional: without it every helper below falls back to `json`.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# orjson.JSONDecodeError subclasses json.JSONDecodeError, so one except clause covers both
+JSONDecodeError = json.JSONDecodeError
+
+
+def loads(data):
+    """Parse JSON from a str or UTF-8 bytes."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj, indent=False):
+    """Serialise `obj` to UTF-8 bytes, keeping non-ASCII characters as-is."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    return json.dumps(obj, ensure_ascii=False, indent=2 if indent else None).encode("utf-8")
+
+
+def load_file(path):
+    """Read and parse a JSON file."""
+    with open(path, "rb") as f:
+        return loads(f.read())
+
+
+def dump_file(obj, path, indent=True):
+    """Write `obj` to `path` as JSON (2-space indented by default)."""
+    with open(path, "wb") as f:
+        f.write(dumps(obj, indent=indent))
@@ -177,18 +177,25 @@ def cleanup_temp_file(file_path: Path):
 
 def generate_subtitles(
     video_path: str, 
-    output_video_path: str, # NEW REQUIRED ARGUMENT
+    output_video_path: str = None, # Required when embed is True
     translation_model: str = "gpt-4o-mini", 
-    subtitle_folder: str = None
+    subtitle_folder: str = None,
+    embed: bool = True
 ):
+    """Create the Finnish/English .ass subtitles for a video and, if `embed`, burn them in.
+
+    Returns the path of the subtitle file that was created or reused, or None on failure.
+    With embed=False no video is written, so the caller can burn the subtitles in as part
+    of its own ffmpeg pass.
+    """
     os.environ["HF_HUB_DISABLE_SYMLINKS_WARNING"] = "1"
 
     video_file = Path(video_path)
-    output_video_file = Path(output_video_path) # USE THIS FOR FINAL OUTPUT
+    output_video_file = Path(output_video_path) if output_video_path else None # USE THIS FOR FINAL OUTPUT
     
     if not video_file.is_file():
         print(f"Error: Video file not found at '{video_path}'")
-        return
+        return None
 
     print(f"Processing video: {video_file.name}")
     start_time = time.time()
@@ -215,6 +222,10 @@ def generate_subtitles(
         ).lower()
         
         if choice == 'e':
+            if not embed:
+                print("Skipping transcription and translation. Reusing existing subtitle file.")
+                return subtitle_check_file
+
             print("Skipping transcription and translation. Embedding existing subtitle file...")
             try:
                 print(f"Step 5: Embedding subtitles into video, writing to: {output_video_file.name}")
@@ -229,7 +240,7 @@ def generate_subtitles(
             finally:
                 pass
             print(f"Finished in {time.time() - start_time:.2f} seconds.")
-            return
+            return subtitle_check_file
 
         print("Proceeding with full transcription, translation, and embedding process.")
     # -------------------------------------------------------------------------
@@ -253,20 +264,25 @@ def generate_subtitles(
         generate_ass_file(subtitle_create_file, finnish_segments, en_texts)
         print(f"ASS file '{subtitle_create_file.name}' created.")
 
-        print("Step 5: Embedding subtitles into video...")
-        # IMPORTANT: Use subtitle_create_file and the new output_video_file path
-        embed_subtitles(video_file, subtitle_create_file, output_video_file)
-        print(f"Subtitled video created: '{output_video_file.name}'")
+        if embed:
+            print("Step 5: Embedding subtitles into video...")
+            # IMPORTANT: Use subtitle_create_file and the new output_video_file path
+            embed_subtitles(video_file, subtitle_create_file, output_video_file)
+            print(f"Subtitled video created: '{output_video_file.name}'")
+        result = subtitle_create_file
 
     except ffmpeg.Error as e:
         print("FFmpeg Error:", e.stderr.decode() if e.stderr else str(e))
+        result = None
     except Exception as e:
         print("Unexpected error:", e)
+        result = None
     finally:
         print("Cleaning up temporary files...")
         cleanup_temp_file(audio_file)
 
     print(f"Finished in {time.time() - start_time:.2f} seconds.")
+    return result
 
 
 if __name__ == "__main__":
@@ -1,110 +1,385 @@
-import os
-import json
-import sys # Added to handle command-line arguments
-from dotenv import load_dotenv
-from elevenlabs.client import ElevenLabs
-
-# --- Configuration (Modified) ---
-CONVERSATION_SCRIPTS_DIR = "scripts"
-PODCAST_SCRIPTS_DIR = "podcast_scripts"
-OUTPUT_AUDIO_DIR = "mp3"
-
-
-def load_dialogue_data(file_path):
-    """Loads the dialogue list from a JSON file."""
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-
-        dialogue_list = data.get("dialogue_list")
-        if not dialogue_list:
-            raise ValueError(f"Missing 'dialogue_list' key in {os.path.basename(file_path)}")
-
-        return dialogue_list
-
-    except (FileNotFoundError, json.JSONDecodeError, ValueError) as e:
-        print(f"❌ Skipping {file_path}: {e}")
-        return None
-
-
-def generate_and_save_audio(elevenlabs_client, dialogue_list, output_filename, script_type):
-    """Generates and saves the conversation or podcast audio for one script."""
-    try:
-        print(f"⏳ Generating {script_type} audio for: {output_filename} ...")
-
-        # Generate audio using ElevenLabs
-        # NOTE: elevenlabs_client.text_to_dialogue.convert is used for both
-        # multi-character dialogue and solo/mixed scripts.
-        audio_stream = elevenlabs_client.text_to_dialogue.convert(inputs=dialogue_list)
-        audio_bytes = b"".join(audio_stream)
-
-        # Save to file
-        os.makedirs(OUTPUT_AUDIO_DIR, exist_ok=True)
-        output_path = os.path.join(OUTPUT_AUDIO_DIR, output_filename)
-
-        with open(output_path, "wb") as f:
-            f.write(audio_bytes)
-
-        print(f"✅ Saved: {output_path}")
-
-    except Exception as e:
-        print(f"❌ ElevenLabs API Error for {output_filename}: {e}")
-
-
-def process_scripts_directory(elevenlabs_client, scripts_dir, script_type):
-    """Helper function to process all JSON files in a given directory."""
-    
-    if not os.path.isdir(scripts_dir):
-        print(f"❌ Folder not found: {scripts_dir}")
-        return
-
-    # Get all JSON files in the scripts folder
-    script_files = [f for f in os.listdir(scripts_dir) if f.endswith(".json")]
-
-    if not script_files:
-        print(f"⚠️ No JSON files found in {scripts_dir}")
-        return
-
-    print(f"🎬 Found {len(script_files)} {script_type} script(s) in '{scripts_dir}'. Starting generation...\n")
-
-    for filename in script_files:
-        file_path = os.path.join(scripts_dir, filename)
-        base_name = os.path.splitext(filename)[0]
-        # Prepend type to filename to avoid naming conflicts if titles are the same
-        output_filename = f"{script_type}_{base_name}.mp3" 
-
-        dialogue_list = load_dialogue_data(file_path)
-        if dialogue_list:
-            generate_and_save_audio(elevenlabs_client, dialogue_list, output_filename, script_type)
-
-    print(f"\n✅ Finished processing {script_type} scripts.")
-
-
-def main():
-    # Load environment variables (API key)
-    load_dotenv()
-    api_key = os.getenv("ELEVENLABS_API_KEY")
-    if not api_key:
-        print("❌ ELEVENLABS_API_KEY not found. Please add it to your .env file.")
-        return
-
-    elevenlabs = ElevenLabs(api_key=api_key)
-
-    # Determine which folder to process based on command-line argument
-    if len(sys.argv) > 1 and sys.argv[1].lower() == 'podcast':
-        # Process podcast scripts only
-        process_scripts_directory(elevenlabs, PODCAST_SCRIPTS_DIR, "podcast")
-    elif len(sys.argv) > 1 and sys.argv[1].lower() == 'all':
-        # Process both folders
-        print("Processing ALL scripts (Conversation and Podcast)...")
-        process_scripts_directory(elevenlabs, CONVERSATION_SCRIPTS_DIR, "conversation")
-        process_scripts_directory(elevenlabs, PODCAST_SCRIPTS_DIR, "podcast")
-    else:
-        # Default: Process conversation scripts only
-        process_scripts_directory(elevenlabs, CONVERSATION_SCRIPTS_DIR, "conversation")
-
-    print("\n🏁 All specified audio generation complete!")
-
-
-if __name__ == "__main__":
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+from contextlib import asynccontextmanager
+
+import httpx
+from dotenv import load_dotenv
+from elevenlabs.client import AsyncElevenLabs
+from elevenlabs.core.api_error import ApiError
+
+import cache_utils
+import json_utils
+
+# --- Load environment variables ---
+# Loaded before the configuration below so values from .env reach every setting
+load_dotenv()
+
+# --- Configuration (Modified) ---
+CONVERSATION_SCRIPTS_DIR = "scripts"
+PODCAST_SCRIPTS_DIR = "podcast_scripts"
+OUTPUT_AUDIO_DIR = "mp3"
+# Number of ElevenLabs requests in flight at once per API key. Requests beyond this wait
+# for a free slot instead of being rejected, so keep it at your plan's concurrency limit.
+ELEVENLABS_CONCURRENCY = int(os.getenv("ELEVENLABS_CONCURRENCY", "4"))
+# Rate-limit and transient server errors are retried with jittered exponential backoff
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+MAX_RETRIES = 3
+MAX_BACKOFF_SECONDS = 30
+# Generous read timeout: long dialogues take a while to synthesise before audio streams back
+HTTP_TIMEOUT_SECONDS = 120
+# Scripts longer than this many characters are split into several requests. The parts are
+# voiced independently, so a lower limit trades a seam in the prosody at each join for
+# shorter requests; the default keeps ordinary conversations and podcasts in one piece.
+TTS_MAX_CHARS = int(os.getenv("TTS_MAX_CHARS", "5000"))
+# Audio already generated for an identical request is copied from here instead of
+# paying ElevenLabs for it again. The least recently used entries are evicted once the
+# cache grows past the cap.
+TTS_CACHE_DIR = ".tts_cache"
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_MB", "1000")) * 1024 * 1024
+
+
+def tts_cache_path(request_params):
+    """Return the cache file for a text_to_dialogue request with these parameters.
+
+    The key covers every argument sent to the API, so changing the dialogue (or adding
+    settings such as a model or voice options later) produces a new entry.
+    """
+    # Canonical serialisation (sorted keys, fixed separators) so the key doesn't depend on
+    # dict ordering or on which JSON library is installed
+    canonical = json.dumps(request_params, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    key = hashlib.blake2b(canonical.encode("utf-8"), digest_size=32).hexdigest()
+    return os.path.join(TTS_CACHE_DIR, key + ".mp3")
+
+
+def load_api_keys():
+    """Return every ELEVENLABS_API_KEY* value set in the environment, without duplicates.
+
+    ELEVENLABS_API_KEY on its own keeps working; ELEVENLABS_API_KEY_1, _2, ... add keys
+    whose concurrency quotas are used side by side.
+    """
+    keys = (v for k, v in sorted(os.environ.items()) if k.startswith("ELEVENLABS_API_KEY") and v)
+    return list(dict.fromkeys(keys))
+
+
+@asynccontextmanager
+async def acquire_client(clients):
+    """Yield the bound convert of the client with the fewest requests in flight, holding a slot."""
+    slot = min(clients, key=lambda c: c["in_flight"])
+    slot["in_flight"] += 1
+    try:
+        async with slot["semaphore"]:
+            yield slot["convert"]
+    finally:
+        slot["in_flight"] -= 1
+
+
+def load_dialogue_data(file_path):
+    """Loads the dialogue list from a JSON file."""
+    try:
+        data = json_utils.load_file(file_path)
+
+        dialogue_list = data.get("dialogue_list")
+        if not dialogue_list:
+            raise ValueError(f"Missing 'dialogue_list' key in {os.path.basename(file_path)}")
+
+        return dialogue_list
+
+    except (FileNotFoundError, json_utils.JSONDecodeError, ValueError) as e:
+        print(f"❌ Skipping {file_path}: {e}")
+        return None
+
+
+async def stream_dialogue_to_file(convert, request_params, path):
+    """Stream one text_to_dialogue request into `path`, retrying rate-limit and server errors.
+
+    A retry reopens `path` for writing, discarding any partial audio from the failed attempt.
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            with open(path, "wb", buffering=1024 * 1024) as f:
+                async for chunk in convert(**request_params):
+                    f.write(chunk)
+            return
+        except ApiError as e:
+            if e.status_code not in RETRYABLE_STATUS_CODES or attempt == MAX_RETRIES:
+                raise
+            delay = random.uniform(0, min(MAX_BACKOFF_SECONDS, 2 ** attempt))
+            print(f"🔁 ElevenLabs returned {e.status_code}, retrying in {delay:.1f}s ({attempt + 1}/{MAX_RETRIES})")
+            await asyncio.sleep(delay)
+
+
+def split_dialogue(dialogue_list, max_chars):
+    """Split a dialogue into contiguous runs of whole turns of at most `max_chars` characters.
+
+    A single turn longer than `max_chars` is never cut mid-sentence; it gets a request of its own.
+    """
+    parts, current, size = [], [], 0
+    for turn in dialogue_list:
+        length = len(turn.get("text", ""))
+        if current and size + length > max_chars:
+            parts.append(current)
+            current, size = [], 0
+        current.append(turn)
+        size += length
+    if current:
+        parts.append(current)
+    return parts
+
+
+async def synthesize_part(clients, dialogue_part, part_path, label, force=False):
+    """Fetch the audio for one request into `part_path`, from the cache unless `force` is set.
+
+    Freshly generated audio is written to the cache either way.
+    """
+    request_params = {"inputs": dialogue_part}
+    cache_path = tts_cache_path(request_params)
+    if not force and os.path.exists(cache_path):
+        await asyncio.to_thread(cache_utils.copy_from_cache, cache_path, part_path)
+        print(f"♻️ Reused cached audio for: {label}")
+        return
+
+    # Only the API call holds a slot; cache hits and file moves never wait for one
+    async with acquire_client(clients) as convert:
+        print(f"⏳ Generating audio for: {label} ...")
+        await stream_dialogue_to_file(convert, request_params, part_path)
+
+    await asyncio.to_thread(cache_utils.store_in_cache, part_path, cache_path)
+
+
+async def concat_mp3(input_paths, output_path):
+    """Join MP3 files in order with ffmpeg's concat demuxer, copying the audio without re-encoding."""
+    list_path = output_path + ".txt"
+    with open(list_path, "w", encoding="utf-8") as f:
+        for path in input_paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    try:
+        process = await asyncio.create_subprocess_exec(
+            "ffmpeg", "-y", "-loglevel", "error",
+            "-f", "concat", "-safe", "0", "-i", list_path,
+            "-c", "copy", "-f", "mp3", output_path,
+        )
+        if await process.wait() != 0:
+            raise RuntimeError(f"ffmpeg concat exited with code {process.returncode}")
+    finally:
+        os.remove(list_path)
+
+
+async def generate_and_save_audio(clients, dialogue_list, output_filename, script_type, force=False):
+    """Generates and saves the conversation or podcast audio for one script.
+
+    Returns True once the MP3 is saved, False if generation failed.
+    """
+    try:
+        output_path = os.path.join(OUTPUT_AUDIO_DIR, output_filename)
+
+        # Long scripts are sent as several shorter requests that run side by side and are
+        # joined afterwards; each part is also cached on its own, so a rerun after a failure
+        # only regenerates the parts that are missing.
+        parts = split_dialogue(dialogue_list, TTS_MAX_CHARS)
+        if len(parts) > 1:
+            total_chars = sum(len(turn.get("text", "")) for turn in dialogue_list)
+            print(f"✂️ {output_filename}: {total_chars} characters, split into {len(parts)} requests")
+
+        # Generate audio using ElevenLabs and save it chunk by chunk as it arrives.
+        # NOTE: text_to_dialogue.convert is used for both
+        # multi-character dialogue and solo/mixed scripts.
+        # The stream goes to a .part file that is renamed into place once complete, so an
+        # interrupted request never leaves a truncated MP3 behind.
+        part_path = output_path + ".part"
+        if len(parts) == 1:
+            segment_paths = [part_path]
+        else:
+            segment_paths = [f"{output_path}.{i}.part" for i in range(len(parts))]
+
+        try:
+            results = await asyncio.gather(
+                *(
+                    synthesize_part(
+                        clients,
+                        dialogue_part,
+                        segment_path,
+                        output_filename if len(parts) == 1 else f"{output_filename} (part {i + 1}/{len(parts)})",
+                        force,
+                    )
+                    for i, (dialogue_part, segment_path) in enumerate(zip(parts, segment_paths))
+                ),
+                # Let the other parts finish (and reach the cache) even if one fails
+                return_exceptions=True,
+            )
+            for result in results:
+                if isinstance(result, BaseException):
+                    raise result
+
+            if len(parts) > 1:
+                await concat_mp3(segment_paths, part_path)
+            os.replace(part_path, output_path)
+        finally:
+            for path in {part_path, *segment_paths}:
+                if os.path.exists(path):
+                    os.remove(path)
+
+        print(f"✅ Saved {script_type} audio: {output_path}")
+        return True
+
+    except Exception as e:
+        # Timeouts and connection errors often have an empty message, so name the type too
+        print(f"❌ ElevenLabs API Error for {output_filename}: {type(e).__name__}: {e}")
+        return False
+
+
+async def _job(clients, file_path, output_filename, script_type, force=False):
+    """Load one script and generate its audio. Returns True on success."""
+    # Any error stays with this script, so one malformed file never cancels the others
+    try:
+        dialogue_list = load_dialogue_data(file_path)
+        if not dialogue_list:
+            return False
+        return await generate_and_save_audio(clients, dialogue_list, output_filename, script_type, force)
+    except Exception as e:
+        print(f"❌ Failed to process {file_path}: {e}")
+        return False
+
+
+def collect_jobs(scripts_dir, script_type, force=False):
+    """Return (file_path, output_filename, script_type) for every script in `scripts_dir` still to voice."""
+    
+    if not os.path.isdir(scripts_dir):
+        print(f"❌ Folder not found: {scripts_dir}")
+        return []
+
+    # Get all JSON files in the scripts folder. scandir's DirEntry objects carry the file
+    # type from the directory listing itself, so no extra stat per entry is needed.
+    with os.scandir(scripts_dir) as it:
+        script_entries = [e for e in it if e.name.endswith(".json") and e.is_file()]
+
+    if not script_entries:
+        print(f"⚠️ No JSON files found in {scripts_dir}")
+        return []
+
+    print(f"🎬 Found {len(script_entries)} {script_type} script(s) in '{scripts_dir}'.")
+
+    jobs = []
+    output_prefix = OUTPUT_AUDIO_DIR + os.sep
+    for entry in script_entries:
+        file_path = entry.path
+        # Every entry ends in ".json", so slicing it off is enough
+        base_name = entry.name[:-5]
+        # Prepend type to filename to avoid naming conflicts if titles are the same
+        output_filename = f"{script_type}_{base_name}.mp3" 
+        # Audio from an earlier run is kept, so a rerun after a failure only pays for
+        # the scripts that are still missing
+        output_path = output_prefix + output_filename
+        if not force and os.path.isfile(output_path) and os.path.getsize(output_path) > 0:
+            print(f"⏭️ Skipping {output_filename} (already exists)")
+            continue
+        jobs.append((file_path, output_filename, script_type))
+    return jobs
+
+
+async def process_jobs(clients, jobs, force=False):
+    """Generate audio for every job concurrently, whichever directory it came from."""
+    if not jobs:
+        return
+
+    print(f"Starting generation for {len(jobs)} script(s)...\n")
+    results = await asyncio.gather(*(
+        _job(clients, file_path, output_filename, script_type, force)
+        for file_path, output_filename, script_type in jobs
+    ))
+
+    failed = [file_path for (file_path, _, _), ok in zip(jobs, results) if not ok]
+    print(f"\n✅ Generated audio for {len(jobs) - len(failed)} script(s).")
+    if failed:
+        print(f"❌ {len(failed)} script(s) failed: {', '.join(failed)}")
+
+
+async def async_main(api_keys, mode="conversation", concurrency=ELEVENLABS_CONCURRENCY, force=False):
+    # All clients share one connection pool, so every request after the first reuses a
+    # warm TLS connection to api.elevenlabs.io instead of handshaking again
+    max_connections = concurrency * len(api_keys)
+    async with httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        timeout=HTTP_TIMEOUT_SECONDS,
+    ) as http_client:
+        await run_generation(http_client, api_keys, mode, concurrency, force)
+
+
+async def run_generation(http_client, api_keys, mode, concurrency, force=False):
+    # One client per API key, each limited to its own quota of concurrent requests. Only its
+    # bound text_to_dialogue.convert is kept, so requests skip the attribute lookups.
+    clients = [
+        {
+            # The SDK sends its own per-request timeout (240s by default), which overrides
+            # the one on http_client, so the limit is set here as well
+            "convert": AsyncElevenLabs(
+                api_key=key, httpx_client=http_client, timeout=HTTP_TIMEOUT_SECONDS
+            ).text_to_dialogue.convert,
+            "semaphore": asyncio.Semaphore(concurrency),
+            "in_flight": 0,
+        }
+        for key in api_keys
+    ]
+    if len(clients) > 1:
+        print(f"🔑 Spreading requests across {len(clients)} ElevenLabs API keys")
+
+    # Created once here rather than by every worker before each save
+    os.makedirs(OUTPUT_AUDIO_DIR, exist_ok=True)
+    os.makedirs(TTS_CACHE_DIR, exist_ok=True)
+
+    # Determine which folder to process based on the selected mode
+    if mode == "podcast":
+        # Process podcast scripts only
+        jobs = collect_jobs(PODCAST_SCRIPTS_DIR, "podcast", force)
+    elif mode == "all":
+        # Process both folders as one queue, so podcast scripts fill any free request
+        # slots while the last conversation scripts are still generating
+        print("Processing ALL scripts (Conversation and Podcast)...")
+        jobs = (
+            collect_jobs(CONVERSATION_SCRIPTS_DIR, "conversation", force)
+            + collect_jobs(PODCAST_SCRIPTS_DIR, "podcast", force)
+        )
+    else:
+        # Default: Process conversation scripts only
+        jobs = collect_jobs(CONVERSATION_SCRIPTS_DIR, "conversation", force)
+
+    await process_jobs(clients, jobs, force)
+    cache_utils.prune_cache(TTS_CACHE_DIR, TTS_CACHE_MAX_BYTES)
+
+    print("\n🏁 All specified audio generation complete!")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate MP3 audio for dialogue scripts with ElevenLabs.")
+    parser.add_argument(
+        "mode", nargs="?", default="conversation", type=str.lower,
+        choices=["conversation", "podcast", "all"],
+        help="which scripts to voice (default: conversation)",
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=ELEVENLABS_CONCURRENCY,
+        help=f"concurrent ElevenLabs requests per API key (default: {ELEVENLABS_CONCURRENCY}, set by ELEVENLABS_CONCURRENCY)",
+    )
+    parser.add_argument("--force", action="store_true", help="regenerate MP3s that already exist")
+    args = parser.parse_args(argv)
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+    return args
+
+
+def main():
+    args = parse_args()
+    api_keys = load_api_keys()
+    if not api_keys:
+        print("❌ ELEVENLABS_API_KEY not found. Please add it to your .env file.")
+        return
+
+    asyncio.run(async_main(api_keys, args.mode, args.concurrency, args.force))
+
+
+if __name__ == "__main__":
     main()
\ No newline at end of file